@@ -3,7 +3,6 @@
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-from discretize.utils import mkvc
 import numpy as np
 import src.Meshing as M
 import src.Utils as utils
@@ -16,9 +15,10 @@ domain = ((0, 4000), (-500, 500), (-1200, -1000))
 cell_width = 50
 
 # Define the top geophysical surface
-xx, yy = np.meshgrid(np.linspace(-500, 4500, 101), np.linspace(-2000, 2000, 101))
-zz = np.zeros(np.shape(xx))
-surface = np.c_[mkvc(xx), mkvc(yy), mkvc(zz)]
+xx, yy = np.meshgrid(np.linspace(-500, 4500, 101), np.linspace(-2000, 2000, 101), indexing='ij')
+surface = np.zeros((xx.size, 3))  # the surface lies at z = 0
+surface[:, 0] = xx.ravel()
+surface[:, 1] = yy.ravel()
 
 # Define the model
 box_coordinates = ((200, 600), (-500, 500), (-1000, -800))
@@ -26,14 +26,13 @@ box_surface = M.create_box_surface(box_coordinates, cell_width)
 mesh = M.create_octree_mesh(domain, cell_width, box_surface)
 
 # Defining transmitter location
-xtx, ytx, ztx = np.meshgrid([0], [0], [0])
-source_locations = np.c_[mkvc(xtx), mkvc(ytx), mkvc(ztx)]
-ntx = np.size(xtx)
+source_locations = np.zeros((1, 3))
+ntx = len(source_locations)
 
 # Define receiver locations
 num_receivers = 21
-xrx, yrx, zrx = np.meshgrid(np.linspace(2000, 4000, num_receivers), [0], [0])
-receiver_locations = np.c_[mkvc(xrx), mkvc(yrx), mkvc(zrx)]
+receiver_locations = np.zeros((num_receivers, 3))
+receiver_locations[:, 0] = np.linspace(2000, 4000, num_receivers)
 
 # Define survey
 frequencies = [1.0]  # Frequency (Hz)
@@ -41,8 +40,7 @@ omegas = [2.0 * np.pi]  # Radial frequency (Hz)
 survey = utils.define_survey(frequencies, receiver_locations, source_locations, ntx)
 
 # Refine at certain locations
-M.refine_at_locations(mesh, source_locations)
-M.refine_at_locations(mesh, receiver_locations)
+M.refine_at_locations(mesh, np.vstack([source_locations, receiver_locations]))
 mesh.finalize()
 
 # Resistivity in Ohm m
@@ -61,11 +59,11 @@ ind_block = utils.get_ind_block(mesh, ind_active, box_coordinates)
 model[ind_block] = res_block
 
 # Run the adaptive meshing algorithm
-mesh, ex, ey, ez, diff_list = iterator(mesh, domain, surface, cell_width, box_surface,
-                                       box_coordinates
-                                       , receiver_locations, source_locations, survey
-                                       , res_background, res_block, ind_block, lim_iterations=15,
-                                       interpolation='rbf')
+mesh, ef, diff_list = iterator(mesh, domain, surface, cell_width, box_surface,
+                               box_coordinates
+                               , receiver_locations, source_locations, survey
+                               , res_background, res_block, ind_block, lim_iterations=15,
+                               interpolation='rbf')
 
 
 # Print summary of the final mesh
@@ -7,8 +7,7 @@ import os
 import emg3d
 import requests
 from matplotlib.colors import LogNorm
-from scipy.interpolate import RectBivariateSpline
-from discretize.utils import mkvc
+from scipy.interpolate import RegularGridInterpolator
 import numpy as np
 import src.Meshing as M
 import src.Utils as utils
@@ -25,9 +24,19 @@ fname = 'GemPy-II.h5'
 if not os.path.isfile(fname):
     url = ("https://github.com/emsig/emg3d-gallery/blob/master/examples/"
            f"data/models/{fname}?raw=true")
-    with open(fname, 'wb') as f:
-        t = requests.get(url)
-        f.write(t.content)
+    # Stream the model in chunks to a temporary file, which is only renamed once the download is
+    # complete, such that an interrupted download is not mistaken for the model on the next run
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        size = int(response.headers.get('Content-Length', 0))
+        encoded = 'Content-Encoding' in response.headers
+        written = 0
+        with open(fname + '.part', 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                written += f.write(chunk)
+    if size and not encoded and written != size:
+        raise IOError(f"Incomplete download of {fname}: {written} of {size} bytes")
+    os.replace(fname + '.part', fname)
 
 data = emg3d.load(fname)
 model, mesh = data['model'], data['mesh']
@@ -47,20 +56,23 @@ frequencies = [1.0]  # only use one frequency #frequencies = [0.5, 1.0]
 omegas = [2.0 * np.pi]  # Radial frequency (Hz)
 
 # Define seafloor as every first cell with resistivity lower than 0.33
-seafloor = np.ones((mesh.shape_cells[0], mesh.shape_cells[1]))
-for i in range(mesh.shape_cells[0]):
-    for ii in range(mesh.shape_cells[1]):
-        seafloor[i, ii] = mesh.nodes_z[:-1][
-            model.property_x[i, ii, :] < 0.33][0]
+# (argmax returns the index of the first True value), columns without such cells get the top of
+# the model as seafloor
+water = model.property_x < 0.33
+seafloor = np.where(water.any(axis=2), mesh.nodes_z[:-1][np.argmax(water, axis=2)],
+                    mesh.nodes_z[-1])
 
-# Create a 2D interpolation function from the seafloor
-bathymetry = RectBivariateSpline(
-    mesh.cell_centers_x, mesh.cell_centers_y, seafloor)
+# Create a 2D interpolation function from the seafloor, a bilinear lookup in the regular grid of
+# cell centers needs no spline fit
+bathymetry = RegularGridInterpolator((mesh.cell_centers_x, mesh.cell_centers_y), seafloor,
+                                     bounds_error=False, fill_value=None)
 
 # Seafloor x-, y- and z-coordinates, required for making the octree mesh
-seafloor = np.reshape(seafloor, (len(mesh.cell_centers_x) * len(mesh.cell_centers_y), 1))
-xseafloor, yseafloor = np.meshgrid(mesh.cell_centers_x, mesh.cell_centers_y)
-seafloorxyz = np.c_[mkvc(xseafloor), mkvc(yseafloor), mkvc(seafloor)]
+xseafloor, yseafloor = np.meshgrid(mesh.cell_centers_x, mesh.cell_centers_y, indexing='ij')
+seafloorxyz = np.empty((seafloor.size, 3))
+seafloorxyz[:, 0] = xseafloor.ravel()
+seafloorxyz[:, 1] = yseafloor.ravel()
+seafloorxyz[:, 2] = seafloor.ravel()
 seafloorxyz = seafloorxyz[(seafloorxyz[:, 0] > 9000) & ((seafloorxyz[:, 0] < 19000))
                           & (seafloorxyz[:, 1] > 2500) & (seafloorxyz[:, 1] < 12500)]
 
@@ -69,26 +81,26 @@ src_x = 2 * 5000
 src_y = 7500
 
 # Source depths: 50 m above seafloor
-src_z = bathymetry(src_x, src_y).ravel() + 50
-xtx, ytx, ztx = np.meshgrid([src_x], [src_y], [src_z[0]])
-source_locations = np.c_[mkvc(xtx), mkvc(ytx), mkvc(ztx)]
-ntx = np.size(xtx)
+src_z = bathymetry([src_x, src_y]) + 50
+source_locations = np.array([[src_x, src_y, src_z[0]]])
+ntx = len(source_locations)
 
 # Define receiver locations
 rec_x = np.arange(11, 18) * 1e3
 rec_y = np.arange(3) * 1e3 + 6500
-RZ = bathymetry(rec_x, rec_y)
 RX, RY = np.meshgrid(rec_x, rec_y, indexing='ij')
-xrx, yrx, zrx = RX, RY, RZ
-receiver_locations = np.c_[mkvc(xrx), mkvc(yrx), mkvc(zrx)]
+RZ = bathymetry((RX, RY))
+receiver_locations = np.empty((RX.size, 3))
+receiver_locations[:, 0] = RX.ravel(order='F')
+receiver_locations[:, 1] = RY.ravel(order='F')
+receiver_locations[:, 2] = RZ.ravel(order='F')
 
 # Create survey
 survey = utils.define_survey(frequencies, receiver_locations, source_locations, ntx)
 
 # Generate octree mesh
 octreemesh = M.create_octree_mesh(domain, cell_width, seafloorxyz)
-M.refine_at_locations(octreemesh, source_locations)
-M.refine_at_locations(octreemesh, receiver_locations)
+M.refine_at_locations(octreemesh, np.vstack([source_locations, receiver_locations]))
 octreemesh.finalize()
 
 # Interpolate resistivity values to map them from the tensor mesh onto the octree mesh
@@ -113,7 +125,7 @@ plt.ioff()
 plt.show()
 
 # Find cells that are active in the forward modeling (cells below user-defined surface)
-ind_active = np.array([True] * octreemesh.n_cells)
+ind_active = np.ones(octreemesh.n_cells, dtype=bool)
 
 # Define mapping from model to active cells
 model_map = maps.InjectActiveCells(octreemesh, ind_active, 1e8)
@@ -122,19 +134,17 @@ model_map = maps.InjectActiveCells(octreemesh, ind_active, 1e8)
 model = resfunction(octreemesh.cell_centers)
 
 # In this function the octree mesh will be re-iterated.
-octreemesh, Extest, Eytest, Eztest, diff_list = iteratornonobject(octreemesh, domain
-                                                                  , cell_width, seafloorxyz
-                                                                  , receiver_locations,
-                                                                  source_locations, survey
-                                                                  , resfunction, model_map
-                                                                  , model, lim_iterations=20)
+octreemesh, Etest, diff_list = iteratornonobject(octreemesh, domain
+                                                 , cell_width, seafloorxyz
+                                                 , receiver_locations,
+                                                 source_locations, survey
+                                                 , resfunction, model_map
+                                                 , model, lim_iterations=20)
 
 # Print converged octree mesh
 print(octreemesh)
 
 # Store relevant data: mesh, interpolated functions of the electric field and convergence list.
 np.save('convergence.npy', diff_list)
-np.save('interpolatorEx.npy', Extest)
-np.save('interpolatorEy.npy', Eytest)
-np.save('interpolatorEz.npy', Eztest)
+np.save('interpolatorE.npy', Etest)
 octreemesh.save('octree.json')
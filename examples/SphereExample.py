@@ -3,7 +3,6 @@
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-from discretize.utils import mkvc
 import numpy as np
 import src.Meshing as M
 import src.Utils as utils
@@ -16,9 +15,10 @@ domain = ((-500, 4500), (-2000, 2000), (-2500, 200))
 cell_width = 50
 
 # Define the top geophysical surface
-xx, yy = np.meshgrid(np.linspace(-500, 4500, 101), np.linspace(-2000, 2000, 101))
-zz = np.zeros(np.shape(xx))
-surface = np.c_[mkvc(xx), mkvc(yy), mkvc(zz)]
+xx, yy = np.meshgrid(np.linspace(-500, 4500, 101), np.linspace(-2000, 2000, 101), indexing='ij')
+surface = np.zeros((xx.size, 3))  # the surface lies at z = 0
+surface[:, 0] = xx.ravel()
+surface[:, 1] = yy.ravel()
 
 # Define the model
 sphere_origin = ((1000), (300), (-1200))
@@ -27,14 +27,13 @@ sphere_surface = M.create_sphere_surface(sphere_origin, radius, 101)
 mesh = M.create_octree_mesh(domain, cell_width, sphere_surface)
 
 # Defining transmitter location
-xtx, ytx, ztx = np.meshgrid([0], [0], [0])
-source_locations = np.c_[mkvc(xtx), mkvc(ytx), mkvc(ztx)]
-ntx = np.size(xtx)
+source_locations = np.zeros((1, 3))
+ntx = len(source_locations)
 
 # Define receiver locations
 N = 21
-xrx, yrx, zrx = np.meshgrid(np.linspace(2000, 4000, N), [0], [0])
-receiver_locations = np.c_[mkvc(xrx), mkvc(yrx), mkvc(zrx)]
+receiver_locations = np.zeros((N, 3))
+receiver_locations[:, 0] = np.linspace(2000, 4000, N)
 
 # Define survey
 frequencies = [1.0]  # Frequency (Hz)
@@ -42,8 +41,7 @@ omegas = [2.0 * np.pi]  # Radial frequency (Hz)
 survey = utils.define_survey(frequencies, receiver_locations, source_locations, ntx)
 
 # Refine at certain locations
-M.refine_at_locations(mesh, source_locations)
-M.refine_at_locations(mesh, receiver_locations)
+M.refine_at_locations(mesh, np.vstack([source_locations, receiver_locations]))
 mesh.finalize()
 
 # Resistivity in Ohm m
@@ -62,11 +60,11 @@ ind_sphere = utils.get_ind_sphere(mesh, ind_active, sphere_origin, radius)
 model[ind_sphere] = res_block
 
 # Run the adaptive meshing algorithm
-mesh, ex, ey, ez, diff_list = iterator(mesh, domain, surface, cell_width, sphere_surface,
-                                       sphere_origin
-                                       , receiver_locations, source_locations, survey
-                                       , res_background, res_block, ind_sphere, lim_iterations=20,
-                                       radius=radius, interpolation='rbf', type_object='sphere')
+mesh, ef, diff_list = iterator(mesh, domain, surface, cell_width, sphere_surface,
+                               sphere_origin
+                               , receiver_locations, source_locations, survey
+                               , res_background, res_block, ind_sphere, lim_iterations=20,
+                               radius=radius, interpolation='rbf', type_object='sphere')
 
 # Print summary of the final mesh
 print(mesh)
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
 
+from functools import partial
 import numpy as np
-from scipy.interpolate import Rbf, LinearNDInterpolator, NearestNDInterpolator
-import numdifftools as nd
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy.interpolate import RBFInterpolator, LinearNDInterpolator
+from scipy.linalg import lu_factor, lu_solve
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+from scipy.special import xlogy
 from src.Meshing import *
 from SimPEG.utils import surface2ind_topo
 from src.Utils import *
@@ -14,8 +19,153 @@ try:
 except ImportError:
     from SimPEG import SolverLU as Solver
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+
+def _evaluate_xyz(interpolator, x, y, z):
+    """Evaluates an interpolator of (N, 3) points at x-, y- and z-coordinates."""
+
+    x, y, z = np.broadcast_arrays(x, y, z)
+    values = interpolator(np.column_stack([x.ravel(), y.ravel(), z.ravel()]))
+    return values.reshape(x.shape)
+
+
+class FactorizedRbf:
+    """Thin plate spline interpolation that solves for all value columns with one factorization.
+
+    The interpolation matrix of the nodes is built and LU-factorized once. All value columns,
+    with the real and imaginary parts of complex values as separate columns, are solved for as
+    right-hand sides of that factorization, and evaluation is a dense kernel-matrix product.
+
+    Parameters
+    ----------
+    nodes : np.ndarray
+        (N, 3) array with the coordinates of the data points
+    values : np.ndarray
+        (N,) or (N, K) array with the real or complex data values
+    """
+
+    def __init__(self, nodes, values):
+        self.nodes = np.asarray(nodes, dtype=float)
+        values = np.asarray(values)
+        self.is_complex = np.iscomplexobj(values)
+        self.value_shape = values.shape[1:]
+        values = values.reshape(len(values), -1)
+
+        # Shift and scale the coordinates of the linear polynomial for a better conditioning
+        minimum = self.nodes.min(axis=0)
+        maximum = self.nodes.max(axis=0)
+        self.shift = (maximum + minimum) / 2
+        self.scale = (maximum - minimum) / 2
+        self.scale[self.scale == 0] = 1
+
+        n_nodes = len(self.nodes)
+        polynomial = self._polynomial(self.nodes)
+        matrix = np.zeros((n_nodes + 4, n_nodes + 4))
+        matrix[:n_nodes, :n_nodes] = self._kernel(self.nodes)
+        matrix[:n_nodes, n_nodes:] = polynomial
+        matrix[n_nodes:, :n_nodes] = polynomial.T
+        self.factorization = lu_factor(matrix)
+
+        columns = [values.real, values.imag] if self.is_complex else [values.real]
+        rhs = np.zeros((n_nodes + 4, len(columns) * values.shape[1]))
+        rhs[:n_nodes] = np.hstack(columns)
+        self.coefficients = lu_solve(self.factorization, rhs)
+
+    def _kernel(self, points):
+        distance = cdist(points, self.nodes)
+        return xlogy(distance ** 2, distance)
+
+    def _polynomial(self, points):
+        return np.column_stack([np.ones(len(points)), (points - self.shift) / self.scale])
+
+    def _combine(self, values):
+        """Recombines the real and imaginary value columns along the last axis."""
+
+        if self.is_complex:
+            n_columns = values.shape[-1] // 2
+            values = values[..., :n_columns] + 1j * values[..., n_columns:]
+        return values
+
+    def __call__(self, points):
+        points = np.asarray(points, dtype=float)
+
+        values = np.empty((len(points), self.coefficients.shape[1]))
+        chunk = max(1, 2 ** 22 // len(self.nodes))  # limit the size of the kernel matrix
+        for start in range(0, len(points), chunk):
+            block = points[start:start + chunk]
+            values[start:start + chunk] = np.dot(
+                np.hstack([self._kernel(block), self._polynomial(block)]), self.coefficients)
+
+        return self._combine(values).reshape((len(points),) + self.value_shape)
+
+    def gradient(self, points):
+        """Evaluates the gradient of the interpolation analytically.
+
+        The gradient of the kernel r^2 log(r) is (2 log(r) + 1) times the vector from the node
+        to the point, which vanishes at the node itself. The derivatives are stored along the
+        last axis of the result.
+        """
+        points = np.asarray(points, dtype=float)
+
+        n_nodes = len(self.nodes)
+        kernel_coefficients = self.coefficients[:n_nodes]
+        linear_coefficients = self.coefficients[n_nodes + 1:] / self.scale[:, None]
+
+        gradient = np.empty((len(points), 3, self.coefficients.shape[1]))
+        chunk = max(1, 2 ** 22 // (3 * n_nodes))  # limit the size of the difference vectors
+        for start in range(0, len(points), chunk):
+            difference = points[start:start + chunk, None, :] - self.nodes[None, :, :]
+            distance = np.linalg.norm(difference, axis=2)
+            factor = 2 * np.log(distance, out=np.zeros_like(distance), where=distance > 0) + 1
+            gradient[start:start + chunk] = np.einsum(
+                'mnj,nk->mjk', factor[:, :, None] * difference, kernel_coefficients,
+                optimize=True) + linear_coefficients
+
+        gradient = np.moveaxis(self._combine(gradient), 1, -1)
+        return gradient.reshape((len(points),) + self.value_shape + (3,))
+
+
+class NearestValues:
+    """Nearest neighbour interpolation on the points of a prebuilt cKDTree.
+
+    The tree is not built by the interpolation, such that interpolations of different values on
+    the same points share a single tree.
+
+    Parameters
+    ----------
+    tree : scipy.spatial.cKDTree
+        tree of the (N, 3) data points
+    values : np.ndarray
+        (N,) or (N, K) array with the data values
+    """
+
+    def __init__(self, tree, values):
+        self.tree = tree
+        self.values = values
+
+    def __call__(self, points):
+        _, index = self.tree.query(points)
+        return self.values[index]
+
+
+def _average_spacing(points):
+    """Returns the average distance between the points, which the legacy Rbf uses as its shape."""
+
+    edges = np.ptp(points, axis=0)
+    edges = edges[edges > 0]
+    return np.power(np.prod(edges) / len(points), 1 / len(edges))
+
 
-def interpolate_rbf(x, y, z, x_val, y_val, z_val):
+def interpolate_rbf(x, y, z, x_val, y_val, z_val, neighbors=50):
     """Radial basis function interpolation.
 
     Parameters
@@ -32,17 +182,16 @@ def interpolate_rbf(x, y, z, x_val, y_val, z_val):
         curl values or electric field values in the y-direction
     z_val : np.ndarray
         curl values or electric field values in the z-direction
+    neighbors : int
+        number of nearest data points used for each evaluation, None uses all data points and
+        solves a single factorized system per grid
 
     Returns
     -------
-    scipy.interpolate.rbf.Rbf
-        a radial basis function interpolation object
+    callable
+        radial basis function interpolations that take x-, y- and z-coordinates
     """
-    x_interpolated = Rbf(x[:, 0], x[:, 1], x[:, 2], x_val)
-    y_interpolated = Rbf(y[:, 0], y[:, 1], y[:, 2], y_val)
-    z_interpolated = Rbf(z[:, 0], z[:, 1], z[:, 2], z_val)
-
-    return x_interpolated, y_interpolated, z_interpolated
+    return make_interpolators(x, y, z, x_val, y_val, z_val, kind='rbf', neighbors=neighbors)
 
 
 def interpolate_nearest(x, y, z, x_val, y_val, z_val):
@@ -65,14 +214,10 @@ def interpolate_nearest(x, y, z, x_val, y_val, z_val):
 
     Returns
     -------
-    scipy.interpolate.ndgriddata.NearestNDInterpolator
-        a neirest neighbour interpolation object
+    callable
+        neirest neighbour interpolations that take x-, y- and z-coordinates
     """
-    x_interpolated = NearestNDInterpolator(x, x_val)
-    y_interpolated = NearestNDInterpolator(y, y_val)
-    z_interpolated = NearestNDInterpolator(z, z_val)
-
-    return x_interpolated, y_interpolated, z_interpolated
+    return make_interpolators(x, y, z, x_val, y_val, z_val, kind='nearest')
 
 
 def interpolate_linear(x, y, z, x_val, y_val, z_val):
@@ -95,134 +240,310 @@ def interpolate_linear(x, y, z, x_val, y_val, z_val):
 
     Returns
     -------
-    scipy.interpolate.interpnd.LinearNDInterpolator
-        a linear interpolation object
+    callable
+        linear interpolations that take x-, y- and z-coordinates
     """
 
-    x_interpolated = LinearNDInterpolator(x, x_val)
-    y_interpolated = LinearNDInterpolator(y, y_val)
-    z_interpolated = LinearNDInterpolator(z, z_val)
+    return make_interpolators(x, y, z, x_val, y_val, z_val, kind='linear')
 
-    return x_interpolated, y_interpolated, z_interpolated
 
+def make_interpolator(points, values, kind='rbf', neighbors=50, tree=None):
+    """Builds the interpolation of the values on a single set of data points.
 
-def estimate_curl_electric_field(mesh, survey, model_map, model, interpolation='rbf', frequency=1.0,
-                                 omega=2 * np.pi, parameter='resistivity'):
-    """Interpolates the curl and the electric field values in the mesh."""
+    The points are set up once for all value columns: one factorization, triangulation or tree,
+    which also interpolates the real and imaginary parts together.
 
-    x_faces = mesh.faces_x
-    y_faces = mesh.faces_y
-    z_faces = mesh.faces_z
+    Parameters
+    ----------
+    points : np.ndarray
+        (N, 3) array with the coordinates of the data points, e.g. the faces or the cell centers
+        of a mesh
+    values : np.ndarray
+        (N,) or (N, K) array with the values in the data points
+    kind : string
+        'rbf', 'linear' or 'nearest'
+    neighbors : int
+        number of nearest data points used for each radial basis function evaluation, None uses
+        all data points and solves a single factorized system
+    tree : scipy.spatial.cKDTree
+        tree of the data points for the nearest neighbour interpolation, built when not given
 
-    x_edges = mesh.edges_x
-    y_edges = mesh.edges_y
-    z_edges = mesh.edges_z
+    Returns
+    -------
+    callable
+        an interpolation that takes an (M, 3) array of coordinates and returns an (M,) or (M, K)
+        array with the values
+    """
 
-    # Solution by forward modelling for magnetic flux density and electric field
-    if parameter == 'resistivity':
-        simulation = fdem.simulation.Simulation3DMagneticFluxDensity(
-            mesh, survey=survey, rhoMap=model_map, Solver=Solver
-        )
+    if kind == 'rbf':
+        if neighbors is None:
+            return FactorizedRbf(points, values)
+        # A thin plate spline needs a linear polynomial, which is singular wherever the nearest
+        # data points lie in one plane, e.g. around coarse cells that span the whole domain. The
+        # multiquadric of the legacy Rbf only needs a constant and is well-posed for any points.
+        return RBFInterpolator(points, values, neighbors=neighbors, kernel='multiquadric',
+                               epsilon=1 / _average_spacing(points), degree=0)
+    elif kind == 'linear':
+        return LinearNDInterpolator(points, values)
+    return NearestValues(cKDTree(points) if tree is None else tree, values)
+
+
+def make_interpolators(x, y, z, x_val, y_val, z_val, kind='rbf', neighbors=50):
+    """Builds the interpolations of the three components of a field on their own grids.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        x-faces or x-edges of a mesh
+    y : np.ndarray
+        y-faces or y-edges of a mesh
+    z : np.ndarray
+        z-faces or z-edges of a mesh
+    x_val : np.ndarray
+        curl values or electric field values in the x-direction
+    y_val : np.ndarray
+        curl values or electric field values in the y-direction
+    z_val : np.ndarray
+        curl values or electric field values in the z-direction
+    kind : string
+        'rbf', 'linear' or 'nearest'
+    neighbors : int
+        number of nearest data points used for each radial basis function evaluation, None uses
+        all data points and solves a single factorized system per grid
+
+    Returns
+    -------
+    callable
+        interpolations that take x-, y- and z-coordinates
+    """
+
+    return tuple(partial(_evaluate_xyz, make_interpolator(points, values, kind, neighbors))
+                 for points, values in ((x, x_val), (y, y_val), (z, z_val)))
 
-        simulationelectricfield = fdem.simulation.Simulation3DElectricField(
+
+def estimate_curl_electric_field(mesh, survey, model_map, model, interpolation='rbf',
+                                 parameter='resistivity', geometry=None, neighbors=50):
+    """Interpolates the curl and the electric field values in the mesh.
+
+    The curl is interpolated per component on the faces and the electric field with a single
+    vector-valued interpolation on the cell centers. The locations are taken from geometry, as
+    returned by mesh_geometry, when it is given. The electric field values in the cell centers
+    are returned as well. The 'rbf' interpolations use the given number of nearest data points,
+    or all data points through a single factorization per grid when it is None, in which case
+    the Jacobian of the electric field is computed from its analytic gradient."""
+
+    if geometry is None:
+        geometry = mesh_geometry(mesh)
+
+    x_faces = geometry.fx
+    y_faces = geometry.fy
+    z_faces = geometry.fz
+
+    # Solution by forward modelling for the electric field
+    if parameter == 'resistivity':
+        simulation = fdem.simulation.Simulation3DElectricField(
             mesh, survey=survey, rhoMap=model_map, Solver=Solver
         )
     else:
-        simulation = fdem.simulation.Simulation3DMagneticFluxDensity(
+        simulation = fdem.simulation.Simulation3DElectricField(
             mesh, survey=survey, sigmaMap=model_map, Solver=Solver
         )
 
-        simulationelectricfield = fdem.simulation.Simulation3DElectricField(
-            mesh, survey=survey, sigmaMap=model_map, Solver=Solver
-        )
-
-    # Compute magnetic flux density
+    # Electric field solution
     fields = simulation.fields(model)
-    magnetic_flux_density = fields[:, 'bSolution']
+    EF = fields[:, 'eSolution']
+
+    # Curl of Electric field computed on the cell faces. By Faraday's law this equals
+    # Sm - 1j * omega * B, so neither the source term nor the magnetic flux density is needed
+    curl = mesh.edge_curl @ EF
+    # Single precision is sufficient for the refinement indicator and halves the memory of the
+    # field values that are kept by the interpolations
+    curl = np.asarray(curl).ravel(order='F').astype(np.complex64)
+
+    # The face components are views into the curl, no copies are made
+    n_faces_x, n_faces_y, n_faces_z = geometry.nfx, geometry.nfy, geometry.nfz
+    x_curl = curl[:n_faces_x]
+    y_curl = curl[n_faces_x:n_faces_x + n_faces_y]
+    z_curl = curl[n_faces_x + n_faces_y:n_faces_x + n_faces_y + n_faces_z]
+
+    curl_x_inter, curl_y_inter, curl_z_inter = make_interpolators(x_faces, y_faces, z_faces,
+                                                                  x_curl, y_curl, z_curl,
+                                                                  kind=interpolation,
+                                                                  neighbors=neighbors)
+
+    # All components of the electric field are averaged to the cell centers, such that a single
+    # vector-valued interpolation evaluates them together
+    EF = np.asarray(EF).ravel(order='F')
+    EF_cells = np.reshape(mesh.average_edge_to_cell_vector @ EF, (-1, 3), order='F').astype(
+        np.complex64)
+    EF_inter = make_interpolator(geometry.cc, EF_cells, interpolation, neighbors=neighbors,
+                                 tree=geometry.tree)
+
+    return curl_x_inter, curl_y_inter, curl_z_inter, EF_inter, EF_cells
+
+
+def compute_cell_error(cell, curl_x, curl_y, curl_z, ef):
+    """Computes the error in a given cell of a mesh"""
 
-    # Source field
-    sources = simulation.getSourceTerm(frequency)
-    Sm = sources[0]
+    return compute_cell_errors(np.reshape(cell, (1, 3)), curl_x, curl_y, curl_z, ef)[0]
 
-    # Curl of Electric field computed on the cell faces
-    curl = Sm - 1j * omega * magnetic_flux_density
-    curl = np.reshape(curl, len(curl))
 
-    x_curl = curl[0:mesh.n_faces_x]
-    y_curl = curl[mesh.n_faces_x:mesh.n_faces_x + mesh.n_faces_y]
-    z_curl = curl[mesh.n_faces_x + mesh.n_faces_y:mesh.n_faces_x + mesh.n_faces_y + mesh.n_faces_z]
+def batched_jacobian(ef, cells, h=1e-3):
+    """Computes the Jacobian of the electric field in many cells at once.
 
-    if interpolation == 'rbf':
-        interpolator = interpolate_rbf
-    elif interpolation == 'linear':
-        interpolator = interpolate_linear
-    else:
-        interpolator = interpolate_nearest
+    Interpolations with an analytic gradient, such as FactorizedRbf, are differentiated
+    directly. Otherwise all central-difference stencil points of all cells are evaluated in a
+    single call of the interpolator, instead of building the Jacobian cell by cell.
 
-    curl_x_inter, curl_y_inter, curl_z_inter = interpolator(x_faces, y_faces, z_faces, x_curl,
-                                                            y_curl, z_curl)
+    Parameters
+    ----------
+    ef : callable
+        interpolated electric field that maps an (M, 3) array of coordinates to an (M, 3) array
+        with the field components
+    cells : np.ndarray
+        (N, 3) array with the coordinates of the cell centers
+    h : float
+        step size of the central differences
 
-    # Electric field solution
-    fieldselectric = simulationelectricfield.fields(model)
-    EF = fieldselectric[:, 'eSolution']
-    EF = np.reshape(EF, len(EF))
+    Returns
+    -------
+    np.ndarray
+        (N, 3, 3) array where [n, i, j] is the derivative of component i with respect to
+        coordinate j in cell n
+    """
 
-    EF_x = EF[0:mesh.n_edges_x]
-    EF_y = EF[mesh.n_edges_x:mesh.n_edges_x + mesh.n_edges_y]
-    EF_z = EF[
-           mesh.n_edges_x + mesh.n_edges_y:mesh.n_edges_x + mesh.n_edges_y + mesh.n_edges_z]
+    if hasattr(ef, 'gradient'):
+        return ef.gradient(cells)
 
-    EF_x_inter, EF_y_inter, EF_z_inter = interpolator(x_edges, y_edges, z_edges, EF_x, EF_y, EF_z)
+    offsets = np.vstack([np.eye(3) * h, -np.eye(3) * h])
+    points = (cells[:, None, :] + offsets[None, :, :]).reshape(-1, 3)
+    values = np.reshape(ef(points), (len(cells), 6, 3))
 
-    return curl_x_inter, curl_y_inter, curl_z_inter, EF_x_inter, EF_y_inter, EF_z_inter
+    # values[n, j, i] is component i at the stencil point displaced along coordinate j
+    jacobian = (values[:, :3, :] - values[:, 3:, :]).transpose(0, 2, 1) / (2 * h)
+    jacobian[np.isnan(jacobian)] = 0  # handle NaN-values in the jacobian
+    return jacobian
 
 
-def compute_cell_error(cell, curl_x, curl_y, curl_z, ef_x, ef_y, ef_z):
-    """Computes the error in a given cell of a mesh"""
+def _curl_errors_numpy(jacobian, curl_field):
+    """Computes the curl errors with NumPy, evaluating the norm with numexpr when available."""
 
-    def ef_interpolator(x):
-        return np.array([ef_x(*x), ef_y(*x), ef_z(*x)])
+    curl = jacobian[:, [2, 0, 1], [1, 2, 0]] - jacobian[:, [1, 2, 0], [2, 0, 1]]
+    difference = curl_field - curl
+    if ne is None:
+        return np.linalg.norm(difference, axis=1)
 
-    jacobian = nd.Jacobian(ef_interpolator, order=2)(cell)
-    jacobian[np.isnan(jacobian)] = 0  # handle NaN-values in the jacobian
-    curl = np.array([jacobian[2, 1] - jacobian[1, 2], jacobian[0, 2] -
-                     jacobian[2, 0], jacobian[1, 0] - jacobian[0, 1]])
+    # The norm is evaluated in one threaded pass over the real and imaginary parts
+    real, imag = difference.real, difference.imag
+    return ne.evaluate('sqrt(rx * rx + ix * ix + ry * ry + iy * iy + rz * rz + iz * iz)',
+                       local_dict={'rx': real[:, 0], 'ry': real[:, 1], 'rz': real[:, 2],
+                                   'ix': imag[:, 0], 'iy': imag[:, 1], 'iz': imag[:, 2]})
+
+
+def _curl_errors_loop(jacobian, curl_field):
+    """Computes the curl errors in a single loop over the cells without temporary arrays."""
+
+    errors = np.empty(jacobian.shape[0])
+    for n in range(jacobian.shape[0]):
+        dx = curl_field[n, 0] - (jacobian[n, 2, 1] - jacobian[n, 1, 2])
+        dy = curl_field[n, 1] - (jacobian[n, 0, 2] - jacobian[n, 2, 0])
+        dz = curl_field[n, 2] - (jacobian[n, 1, 0] - jacobian[n, 0, 1])
+        errors[n] = np.sqrt(dx.real * dx.real + dx.imag * dx.imag + dy.real * dy.real
+                            + dy.imag * dy.imag + dz.real * dz.real + dz.imag * dz.imag)
+    return errors
+
+
+# The compiled loop releases the GIL for the threads that compute the cell errors in parallel
+_curl_errors_numba = None if njit is None else njit(cache=True, fastmath=True,
+                                                    nogil=True)(_curl_errors_loop)
+
+
+def curl_errors(jacobian, curl_field):
+    """Computes per cell the norm of the difference between the curl field and the curl of the
+    electric field given by its Jacobian.
+
+    The compiled Numba kernel is used when numba is installed, otherwise the NumPy version."""
+
+    if _curl_errors_numba is not None:
+        return _curl_errors_numba(jacobian, curl_field)
+    return _curl_errors_numpy(jacobian, curl_field)
+
+
+def compute_cell_errors(cells, curl_x, curl_y, curl_z, ef):
+    """Computes the errors in the given cells of a mesh"""
 
-    curl_field = np.array([curl_x(*cell), curl_y(*cell), curl_z(*cell)])
-    error = np.linalg.norm(curl_field - curl)
-    return error
+    # The errors only rank the cells, so the difference of the curls is taken in single precision
+    jacobian = batched_jacobian(ef, cells).astype(np.complex64, copy=False)
 
+    x, y, z = cells[:, 0], cells[:, 1], cells[:, 2]
+    curl_field = np.empty((len(cells), 3), dtype=np.complex64)
+    curl_field[:, 0] = curl_x(x, y, z)
+    curl_field[:, 1] = curl_y(x, y, z)
+    curl_field[:, 2] = curl_z(x, y, z)
+    return curl_errors(jacobian, curl_field)
 
-def estimate_error(search_area, curl_x, curl_y, curl_z
-                   , ef_x, ef_y, ef_z,
-                   refine_percentage=0.05):
-    """Estimates the error in a predefined search area in a mesh"""
 
-    cell_errors = []
-    for cell in search_area:
-        error = compute_cell_error(cell, curl_x, curl_y, curl_z, ef_x, ef_y, ef_z)
-        cell_errors.append(error)
+def estimate_error(search_area, curl_x, curl_y, curl_z, ef,
+                   refine_percentage=0.05, n_jobs=-1, chunk_size=1000, debug=False):
+    """Estimates the error in a predefined search area in a mesh.
 
-    np.save('error.npy', np.asarray(cell_errors))
+    The search area is split into chunks of cells whose errors are computed in parallel. With
+    debug the cell errors are also saved to error.npy."""
+
+    cell_errors = np.empty(len(search_area))
+
+    def fill_chunk(start, stop):
+        cell_errors[start:stop] = compute_cell_errors(search_area[start:stop], curl_x, curl_y,
+                                                      curl_z, ef)
+
+    n_chunks = max(1, int(np.ceil(len(search_area) / chunk_size)))
+    bounds = np.linspace(0, len(search_area), n_chunks + 1).astype(int)
+
+    # No more threads than chunks or available cores, and none at all for a single chunk
+    n_jobs = min(n_chunks, effective_n_jobs(n_jobs))
+    if n_jobs == 1:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            fill_chunk(start, stop)
+    else:
+        Parallel(n_jobs=n_jobs, backend='threading')(
+            delayed(fill_chunk)(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]))
+
+    if debug:
+        np.save('error.npy', cell_errors)
     n_refine_cells = int(np.ceil(refine_percentage * len(search_area)))
     cells_to_refine = search_area[np.argpartition(cell_errors, -n_refine_cells)[-n_refine_cells:]]
     return cells_to_refine
 
 
+def relative_difference(cells, ef, ef_old):
+    """Computes the average relative difference between two electric field solutions in the
+    given cells."""
+
+    ef_new = ef(cells)
+    ef_old = ef_old(cells)
+
+    # This equation is sensitive to catastrophic failure
+    relative_difference_Efield = np.linalg.norm(np.abs((ef_old - ef_new) / ef_old), axis=1)
+    return relative_difference_Efield.mean()
+
+
 def iterator(mesh, domain, surface, cell_width, objct, coordinates
              , receiver_locations, source_locations, survey, par_background, par_object,
              ind_object, frequency=1, omega=2 * np.pi
              , parameter='resistivity', interpolation='rbf', type_object='block'
              , lim_iterations=5, factor_object=2, factor_receiver=3, factor_source=3
-             , refine_percentage=0.05, axis='x', degrees_rad=0, radius=1, Ex=None, Ey=None, Ez=None
-             , diff_list=np.array([[0, 0]]), r_a_o_list=None, r_a_r_list=None, r_a_s_list=None):
+             , refine_percentage=0.05, axis='x', degrees_rad=0, radius=1, ef=None
+             , diff_list=np.array([[0, 0]]), r_a_o_list=None, r_a_r_list=None, r_a_s_list=None,
+             neighbors=50):
 
     """An iteration scheme that implements an error estimator to adaptively refine
     a mesh, in order to reduce the error of the electric field solution.
     This function is mainly used for small objects in a domain.
 
     If you want to continue from previous iteration, you have to give the mesh, field values,
-    convergence list and previous refinements as input arguments."""
+    convergence list and previous refinements as input arguments. The radial basis function
+    interpolations use neighbors nearest data points, or all of them when it is None. The
+    frequency and omega arguments are ignored, the frequencies are taken from the survey."""
 
     # Find cells that are active in the forward modeling (cells below surface)
     ind_active = surface2ind_topo(mesh, surface)
@@ -242,27 +563,25 @@ def iterator(mesh, domain, surface, cell_width, objct, coordinates
     diff = 10
     if diff_list[0, 0] == 0:
         i = 0
-        av_diff_list = []
+        n_diff = 0
+        av_diff_list = np.empty((lim_iterations, 2))
         refine_at_object_list = []
         refine_at_receivers_list = []
         refine_at_sources_list = []
     # Starting after the pause
     else:
         i = diff_list[-1, 0]
-        av_diff_list = list(diff_list)
+        # Room for the previous differences and one difference per remaining iteration
+        n_diff = len(diff_list)
+        av_diff_list = np.empty((n_diff + lim_iterations, 2))
+        av_diff_list[:n_diff] = diff_list
         refine_at_object_list = r_a_o_list
         refine_at_receivers_list = r_a_r_list
         refine_at_sources_list = r_a_s_list
         lim_iterations = lim_iterations + i
-        ef_old_x = Ex
-        ef_old_y = Ey
-        ef_old_z = Ez
-
-    def ef_interpolator(x):
-        return np.array([ef_x(*x), ef_y(*x), ef_z(*x)])
+        ef_old = ef
 
-    def ef_old_interpolator(x):
-        return np.array([ef_old_x(*x), ef_old_y(*x), ef_old_z(*x)])
+    geometry = mesh_geometry(mesh)
 
     while diff > 0.01 and i < lim_iterations:
         # Maximum relative difference between current and previous iteration should fall below 1% in order to converge.
@@ -274,95 +593,41 @@ def iterator(mesh, domain, surface, cell_width, objct, coordinates
         search_area_sourc = search_area_sources(mesh, source_locations,
                                                 factor=factor_source)
         # Interpolate curl and electric field
-        curl_x, curl_y, curl_z, ef_x, ef_y, ef_z = estimate_curl_electric_field(mesh, survey,
-                                                                                model_map,
-                                                                                model,
-                                                                                interpolation=interpolation,
-                                                                                frequency=frequency,
-                                                                                omega=omega
-                                                                                ,
-                                                                                parameter=parameter)
+        curl_x, curl_y, curl_z, ef, ef_cells = estimate_curl_electric_field(
+            mesh, survey, model_map, model, interpolation=interpolation, parameter=parameter,
+            geometry=geometry, neighbors=neighbors)
+        # The search areas consist of cell centers, so the convergence check only needs a
+        # lookup of the cell-centered field instead of evaluating the interpolation
+        ef_centers = NearestValues(geometry.tree, ef_cells)
         # Compare electric field values until relative difference falls below 1%
-        if diff_list[0, 0] == 0:
-            if i > 0:
-                relative_difference_Efield = []
-                for cell in search_area_obj:
-                    # This equation is sensitive to catastrophic failure
-                    form = np.abs(
-                        (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(
-                            cell))
-                    relative_difference_Efield.append(np.linalg.norm(form))
-                for cell in search_area_receiv:
-                    # This equation is sensitive to catastrophic failure
-                    form = np.abs(
-                        (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(
-                            cell))
-                    relative_difference_Efield.append(np.linalg.norm(form))
-                for cell in search_area_sourc:
-                    # This equation is sensitive to catastrophic failure
-                    form = np.abs(
-                        (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(
-                            cell))
-                    relative_difference_Efield.append(np.linalg.norm(form))
-
-                diff = sum(relative_difference_Efield) / len(relative_difference_Efield)
-                av_diff_list.append([i + 1, diff])
-                print("Average relative difference is ", diff)
-        else:
-            relative_difference_Efield = []
-            for cell in search_area_obj:
-                # This equation is sensitive to catastrophic failure
-                form = np.abs(
-                    (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(cell))
-                relative_difference_Efield.append(np.linalg.norm(form))
-            for cell in search_area_receiv:
-                # This equation is sensitive to catastrophic failure
-                form = np.abs(
-                    (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(cell))
-                relative_difference_Efield.append(np.linalg.norm(form))
-            for cell in search_area_sourc:
-                # This equation is sensitive to catastrophic failure
-                form = np.abs(
-                    (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(cell))
-                relative_difference_Efield.append(np.linalg.norm(form))
-
-            diff = sum(relative_difference_Efield) / len(relative_difference_Efield)
-            av_diff_list.append([i + 1, diff])
+        if diff_list[0, 0] != 0 or i > 0:
+            cells = np.vstack([search_area_obj, search_area_receiv, search_area_sourc])
+            diff = relative_difference(cells, ef_centers, ef_old)
+            av_diff_list[n_diff] = i + 1, diff
+            n_diff += 1
             print("Average relative difference is ", diff)
 
-        ef_old_x = ef_x
-        ef_old_y = ef_y
-        ef_old_z = ef_z
+        ef_old = ef_centers
 
         # Define cells to refine near object
-        cells_to_refine_object = estimate_error(search_area_obj
-                                                , curl_x, curl_y, curl_z
-                                                , ef_x, ef_y, ef_z
-                                                , refine_percentage=refine_percentage)
+        cells_to_refine_object = estimate_error(
+            search_area_obj, curl_x, curl_y, curl_z, ef, refine_percentage=refine_percentage)
         refine_at_object_list.append(cells_to_refine_object)
         # Define cells to refine near receivers
-        cells_to_refine_receivers = estimate_error(search_area_receiv
-                                                   , curl_x, curl_y, curl_z
-                                                   , ef_x, ef_y, ef_z
-                                                   , refine_percentage=refine_percentage)
+        cells_to_refine_receivers = estimate_error(
+            search_area_receiv, curl_x, curl_y, curl_z, ef, refine_percentage=refine_percentage)
         refine_at_receivers_list.append(cells_to_refine_receivers)
         # Define cells to refine near sources
-        cells_to_refine_sources = estimate_error(search_area_sourc
-                                                 , curl_x, curl_y, curl_z
-                                                 , ef_x, ef_y, ef_z
-                                                 , refine_percentage=refine_percentage)
+        cells_to_refine_sources = estimate_error(
+            search_area_sourc, curl_x, curl_y, curl_z, ef, refine_percentage=refine_percentage)
         refine_at_sources_list.append(cells_to_refine_sources)
-        # Refine the mesh
-        mesh = create_octree_mesh(domain, cell_width, objct, 'surface')
-        refine_at_locations(mesh, source_locations)
-        refine_at_locations(mesh, receiver_locations)
-        for refo in refine_at_object_list:
-            refine_at_locations(mesh, refo)
-        for refr in refine_at_receivers_list:
-            refine_at_locations(mesh, refr)
-        for refs in refine_at_sources_list:
-            refine_at_locations(mesh, refs)
+        # Refine the mesh, the refinements of previous iterations are already in the mesh
+        mesh = unfinalize_mesh(mesh)
+        # All cells are refined in a single sweep over the octree
+        refine_at_locations(mesh, np.vstack([cells_to_refine_object, cells_to_refine_receivers,
+                                             cells_to_refine_sources]))
         mesh.finalize()
+        geometry = mesh_geometry(mesh)
 
         # Find cells that are active in the forward modeling (cells below surface)
         ind_active = surface2ind_topo(mesh, surface)
@@ -381,10 +646,10 @@ def iterator(mesh, domain, surface, cell_width, objct, coordinates
         print(i)
         i += 1
     if diff < 0.01:
-        return mesh, ef_x, ef_y, ef_z, np.array(av_diff_list)
+        return mesh, ef, av_diff_list[:n_diff]
     else:
-        return mesh, ef_x, ef_y, ef_z, np.array(
-            av_diff_list), refine_at_object_list, refine_at_receivers_list, refine_at_sources_list
+        return (mesh, ef, av_diff_list[:n_diff], refine_at_object_list, refine_at_receivers_list,
+                refine_at_sources_list)
 
 
 def iteratornonobject(mesh, domain, cell_width, landscape, receiver_locations, source_locations,
@@ -393,17 +658,19 @@ def iteratornonobject(mesh, domain, cell_width, landscape, receiver_locations, s
                       , parameter='resistivity', interpolation='rbf'
                       , lim_iterations=5, factor_receiver=2, factor_source=2, factor_landscape=2,
                       refine_percentage=0.05, par_inactive=1e8
-                      , Ex=None, Ey=None, Ez=None, diff_list=np.array([[0, 0]]), r_a_l_list=None,
-                      r_a_r_list=None, r_a_s_list=None):
+                      , ef=None, diff_list=np.array([[0, 0]]), r_a_l_list=None,
+                      r_a_r_list=None, r_a_s_list=None, neighbors=50):
     """An iteration scheme that implements an error estimator to adaptively refine
     a mesh, in order to reduce the error of the electric field solution.
     This function is mainly used for large geophysical models.
 
     If you want to continue from previous iteration, you have to give the mesh, field values,
-    convergence list and previous refinements as input arguments."""
+    convergence list and previous refinements as input arguments. The radial basis function
+    interpolations use neighbors nearest data points, or all of them when it is None. The
+    frequency and omega arguments are ignored, the frequencies are taken from the survey."""
 
     # Find cells that are active in the forward modeling (cells below surface)
-    ind_active = np.array([True] * mesh.n_cells)
+    ind_active = np.ones(mesh.n_cells, dtype=bool)
 
     # Define mapping from model to active cells
     model_map = maps.InjectActiveCells(mesh, ind_active, par_inactive)
@@ -415,27 +682,25 @@ def iteratornonobject(mesh, domain, cell_width, landscape, receiver_locations, s
     i = 0
     if diff_list[0, 0] == 0:
         i = 0
-        av_diff_list = []
+        n_diff = 0
+        av_diff_list = np.empty((lim_iterations, 2))
         refine_at_landscape_list = []
         refine_at_receivers_list = []
         refine_at_sources_list = []
     # Starting after the pause
     else:
         i = diff_list[-1, 0]
-        av_diff_list = list(diff_list)
+        # Room for the previous differences and one difference per remaining iteration
+        n_diff = len(diff_list)
+        av_diff_list = np.empty((n_diff + lim_iterations, 2))
+        av_diff_list[:n_diff] = diff_list
         refine_at_landscape_list = r_a_l_list
         refine_at_receivers_list = r_a_r_list
         refine_at_sources_list = r_a_s_list
         lim_iterations = lim_iterations + i
-        ef_old_x = Ex
-        ef_old_y = Ey
-        ef_old_z = Ez
-
-    def ef_interpolator(x):
-        return np.array([ef_x(*x), ef_y(*x), ef_z(*x)])
+        ef_old = ef
 
-    def ef_old_interpolator(x):
-        return np.array([ef_old_x(*x), ef_old_y(*x), ef_old_z(*x)])
+    geometry = mesh_geometry(mesh)
 
     while diff > 0.01 and i < lim_iterations:
         # Maximum relative difference between current and previous iteration should fall below 1%
@@ -449,95 +714,48 @@ def iteratornonobject(mesh, domain, cell_width, landscape, receiver_locations, s
         search_area_sourc = search_area_sources(mesh, source_locations,
                                                 factor=factor_source)
         # Interpolate curl and electric field
-        curl_x, curl_y, curl_z, ef_x, ef_y, ef_z = estimate_curl_electric_field(mesh, survey,
-                                                                                model_map,
-                                                                                model,
-                                                                                interpolation=interpolation,
-                                                                                frequency=frequency,
-                                                                                omega=omega
-                                                                                ,
-                                                                                parameter=parameter)
+        curl_x, curl_y, curl_z, ef, ef_cells = estimate_curl_electric_field(
+            mesh, survey, model_map, model, interpolation=interpolation, parameter=parameter,
+            geometry=geometry, neighbors=neighbors)
+        # The search areas consist of cell centers, so the convergence check only needs a
+        # lookup of the cell-centered field instead of evaluating the interpolation
+        ef_centers = NearestValues(geometry.tree, ef_cells)
         # Compare electric field values until relative difference falls below 1%
-        if diff_list[0, 0] == 0:
-            if i > 0:
-                relative_difference_Efield = []
-                for cell in search_area_below_landscape:
-                    form = np.abs(
-                        (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(
-                            cell))
-                    relative_difference_Efield.append(np.linalg.norm(form))
-                for cell in search_area_receiv:
-                    form = np.abs(
-                        (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(
-                            cell))
-                    relative_difference_Efield.append(np.linalg.norm(form))
-                for cell in search_area_sourc:
-                    form = np.abs(
-                        (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(
-                            cell))
-                    relative_difference_Efield.append(np.linalg.norm(form))
-
-                diff = sum(relative_difference_Efield) / len(relative_difference_Efield)
-                av_diff_list.append([i + 1, diff])
-                print("Average relative difference is ", diff)
-        else:
-            relative_difference_Efield = []
-            for cell in search_area_below_landscape:
-                form = np.abs(
-                    (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(cell))
-                relative_difference_Efield.append(np.linalg.norm(form))
-            for cell in search_area_receiv:
-                form = np.abs(
-                    (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(cell))
-                relative_difference_Efield.append(np.linalg.norm(form))
-            for cell in search_area_sourc:
-                form = np.abs(
-                    (ef_old_interpolator(cell) - ef_interpolator(cell)) / ef_old_interpolator(cell))
-                relative_difference_Efield.append(np.linalg.norm(form))
-
-            diff = sum(relative_difference_Efield) / len(relative_difference_Efield)
-            av_diff_list.append([i + 1, diff])
+        if diff_list[0, 0] != 0 or i > 0:
+            cells = np.vstack([search_area_below_landscape, search_area_receiv, search_area_sourc])
+            diff = relative_difference(cells, ef_centers, ef_old)
+            av_diff_list[n_diff] = i + 1, diff
+            n_diff += 1
             print("Average relative difference is ", diff)
 
-        ef_old_x = ef_x
-        ef_old_y = ef_y
-        ef_old_z = ef_z
+        ef_old = ef_centers
 
         # Define cells to refine near object
-        cells_to_refine_landscape = estimate_error(search_area_below_landscape
-                                                   , curl_x, curl_y, curl_z
-                                                   , ef_x, ef_y, ef_z
-                                                   , refine_percentage=refine_percentage)
+        cells_to_refine_landscape = estimate_error(
+            search_area_below_landscape, curl_x, curl_y, curl_z, ef,
+            refine_percentage=refine_percentage)
         refine_at_landscape_list.append(cells_to_refine_landscape)
 
         # Define cells to refine near receivers
-        cells_to_refine_receivers = estimate_error(search_area_receiv
-                                                   , curl_x, curl_y, curl_z
-                                                   , ef_x, ef_y, ef_z
-                                                   , refine_percentage=refine_percentage)
+        cells_to_refine_receivers = estimate_error(
+            search_area_receiv, curl_x, curl_y, curl_z, ef, refine_percentage=refine_percentage)
         refine_at_receivers_list.append(cells_to_refine_receivers)
 
         # Define cells to refine near sources
-        cells_to_refine_sources = estimate_error(search_area_sourc
-                                                 , curl_x, curl_y, curl_z
-                                                 , ef_x, ef_y, ef_z
-                                                 , refine_percentage=refine_percentage)
+        cells_to_refine_sources = estimate_error(
+            search_area_sourc, curl_x, curl_y, curl_z, ef, refine_percentage=refine_percentage)
         refine_at_sources_list.append(cells_to_refine_sources)
 
-        # Refine the mesh
-        mesh = create_octree_mesh(domain, cell_width, landscape, 'surface')
-        refine_at_locations(mesh, source_locations)
-        refine_at_locations(mesh, receiver_locations)
-        for refo in refine_at_landscape_list:
-            refine_at_locations(mesh, refo)
-        for refr in refine_at_receivers_list:
-            refine_at_locations(mesh, refr)
-        for refs in refine_at_sources_list:
-            refine_at_locations(mesh, refs)
+        # Refine the mesh, the refinements of previous iterations are already in the mesh
+        mesh = unfinalize_mesh(mesh)
+        # All cells are refined in a single sweep over the octree
+        refine_at_locations(mesh, np.vstack([cells_to_refine_landscape, cells_to_refine_receivers,
+                                             cells_to_refine_sources]))
         mesh.finalize()
+        geometry = mesh_geometry(mesh)
 
         # Find cells that are active in the forward modeling (cells below surface)
-        ind_active = np.array([True] * mesh.n_cells)
+        ind_active = np.ones(mesh.n_cells, dtype=bool)
 
         # Define mapping from model to active cells
         model_map = maps.InjectActiveCells(mesh, ind_active, par_inactive)
@@ -547,7 +765,7 @@ def iteratornonobject(mesh, domain, cell_width, landscape, receiver_locations, s
         print("Iteration: ", i)
         i += 1
     if diff < 0.01:
-        return mesh, ef_x, ef_y, ef_z, np.array(av_diff_list)
+        return mesh, ef, av_diff_list[:n_diff]
     else:
-        return mesh, ef_x, ef_y, ef_z, np.array(
-            av_diff_list), refine_at_landscape_list, refine_at_receivers_list, refine_at_sources_list
+        return (mesh, ef, av_diff_list[:n_diff], refine_at_landscape_list, refine_at_receivers_list,
+                refine_at_sources_list)
@@ -1,9 +1,15 @@
+from collections import namedtuple
 import numpy as np
 import matplotlib.pyplot as plt
 from discretize import TreeMesh
 from discretize.utils import mkvc, refine_tree_xyz
+from scipy.spatial import cKDTree
 from scipy.spatial.transform import Rotation as R
 
+# Face locations and cell centers of a finalized mesh, a tree of the cell centers and the number
+# of faces per direction
+MeshGeom = namedtuple('MeshGeom', 'fx fy fz cc tree nfx nfy nfz')
+
 
 def create_box_surface(coordinates, cellwidth, axis='x', degree_rad=0):
     """Creates a list of coordinates of points on the surface of a box.
@@ -41,16 +47,18 @@ def create_box_surface(coordinates, cellwidth, axis='x', degree_rad=0):
     y_coords = np.linspace(y1, y2, y_num)
     z_coords = np.linspace(z1, z2, z_num)
 
-    xp, yp, zp = np.meshgrid(x_coords, y_coords, z_coords)
-    xyz = np.c_[mkvc(xp), mkvc(yp), mkvc(zp)]
-    surface = []
-    for row in xyz:
-        if row[0] == x1 or row[0] == x2 or row[1] == y1 or row[1] == y2 or row[2] == z1 or row[2] == z2:
-            surface.append(row)
+    # Only the surface points of the box grid are created, the grid itself is a boolean mask that
+    # broadcasts the sparse coordinate vectors
+    xp, yp, zp = np.meshgrid(x_coords, y_coords, z_coords, sparse=True)
+    on_surface = (xp == x1) | (xp == x2) | (yp == y1) | (yp == y2) | (zp == z1) | (zp == z2)
+
+    # The transpose keeps the Fortran order of the points that mkvc would give
+    iz, ix, iy = np.nonzero(on_surface.T)
+    xyz = np.c_[x_coords[ix], y_coords[iy], z_coords[iz]]
 
+    # Rotate all surface points at once, row-wise this is the product with the transpose
     rotation = R.from_euler(axis, degree_rad, degrees=True).as_matrix()
-    surface = np.asarray([np.dot(rotation, i) for i in surface])
-    return np.asarray(surface)
+    return xyz @ rotation.T
 
 
 def create_sphere_surface(origin, radius, num_points):
@@ -86,6 +94,13 @@ def create_sphere_surface(origin, radius, num_points):
     return np.asarray(surface)
 
 
+def _next_power_of_two(ratio):
+    """Returns the smallest power of two that is at least the given ratio, computed on the integer
+    number of cells instead of with floating point logarithms."""
+
+    return 1 << (max(int(np.ceil(ratio)), 1) - 1).bit_length()
+
+
 def create_octree_mesh(domain, cellwidth, points, method='surface'):
     """Creates an octree mesh and refines at specified points.
 
@@ -114,9 +129,9 @@ def create_octree_mesh(domain, cellwidth, points, method='surface'):
     z_length = np.abs(domain[2][0] - domain[2][1])
 
     # number of cells needed in each dimension
-    nbx = 2 ** int(np.ceil(np.log(x_length / cellwidth) / np.log(2.0)))
-    nby = 2 ** int(np.ceil(np.log(y_length / cellwidth) / np.log(2.0)))
-    nbz = 2 ** int(np.ceil(np.log(z_length / cellwidth) / np.log(2.0)))
+    nbx = _next_power_of_two(x_length / cellwidth)
+    nby = _next_power_of_two(y_length / cellwidth)
+    nbz = _next_power_of_two(z_length / cellwidth)
 
     # define base mesh 
     hx = cellwidth * np.ones(nbx)
@@ -131,6 +146,40 @@ def create_octree_mesh(domain, cellwidth, points, method='surface'):
     return mesh
 
 
+def morton_order(points, bits=21):
+    """Returns the indices that sort points along a Morton (Z-order) space-filling curve.
+
+         Parameters
+         ----------
+         points : np.ndarray
+             (N, 3) array with the coordinates of the points
+         bits : int
+             number of bits per coordinate of the quantized points, at most 21
+
+         Returns
+         -------
+         np.ndarray
+             the indices that sort the points along the curve
+    """
+
+    points = np.asarray(points, dtype=float)
+    if len(points) == 0:
+        return np.arange(0)
+
+    minimum = points.min(axis=0)
+    extent = np.ptp(points, axis=0)
+    extent[extent == 0] = 1
+    quantized = ((points - minimum) / extent * (2 ** bits - 1)).astype(np.uint64)
+
+    # Interleave the bits of the three quantized coordinates
+    code = np.zeros(len(points), dtype=np.uint64)
+    for bit in range(bits):
+        for axis in range(3):
+            code |= ((quantized[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(
+                3 * bit + axis)
+    return np.argsort(code, kind='stable')
+
+
 def refine_at_locations(mesh, locations):
     """Refines a mesh at the given locations.
 
@@ -147,12 +196,55 @@ def refine_at_locations(mesh, locations):
              a mesh where the new points are also refined
     """
 
+    # Points that are close in space are refined after each other, such that the descent into the
+    # octree stays in the same branches
+    locations = np.asarray(locations)[morton_order(locations)]
     mesh = refine_tree_xyz(
         mesh, locations, octree_levels=[1, 1], method="radial", finalize=False
     )
     return mesh
 
 
+def unfinalize_mesh(mesh):
+    """Creates a not yet finalized copy of a finalized mesh, so it can be refined further.
+
+         Parameters
+         ----------
+         mesh : discretize.mesh
+             a finalized discretize mesh
+
+         Returns
+         -------
+         discretize.mesh
+             a not yet finalized mesh with the same cells
+    """
+
+    copy = TreeMesh(mesh.h, origin=mesh.origin)
+    levels = mesh.cell_levels_by_index(np.arange(mesh.n_cells))
+    copy.insert_cells(mesh.cell_centers, levels, finalize=False)
+    return copy
+
+
+def mesh_geometry(mesh):
+    """Collects the face locations and cell centers of a mesh with a tree of the cell centers.
+
+         Parameters
+         ----------
+         mesh : discretize.mesh
+             a finalized discretize mesh
+
+         Returns
+         -------
+         MeshGeom
+             the face locations in the x-, y- and z-direction, the cell centers, a cKDTree of
+             the cell centers and the numbers of faces in the x-, y- and z-direction
+    """
+
+    return MeshGeom(mesh.faces_x, mesh.faces_y, mesh.faces_z,
+                    mesh.cell_centers, cKDTree(mesh.cell_centers),
+                    mesh.n_faces_x, mesh.n_faces_y, mesh.n_faces_z)
+
+
 def plot_mesh_slice(mesh, axis, index, save=False):
     """Plots a single slice of a mesh.
 
@@ -2,6 +2,11 @@ import SimPEG.electromagnetics.frequency_domain as fdem
 from scipy.spatial.transform import Rotation as Rot
 import numpy as np
 
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
 
 def define_survey(frequencies, receiver_locations, source_locations, num_transmitters):
     """Defines a survey of a model with the receivers and the transmitters."""
@@ -32,26 +37,45 @@ def define_survey(frequencies, receiver_locations, source_locations, num_transmi
     return survey
 
 
+def box_mask(points, lower, upper, inclusive=False):
+    """Returns a boolean mask of the points that lie between the lower and upper corners of a box.
+
+    With numexpr the six comparisons are evaluated in a single fused pass over the points.
+    Otherwise they are combined in place into the mask, using a single buffer for the comparison
+    results instead of a new array per comparison. The bounds belong to the box when inclusive
+    is set."""
+
+    if ne is not None:
+        greater, less = ('>=', '<=') if inclusive else ('>', '<')
+        names = ('x', 'y', 'z')
+        expression = ' & '.join(f'({name} {greater} {name}0) & ({name} {less} {name}1)'
+                                for name in names)
+        variables = {}
+        for i, name in enumerate(names):
+            variables[name] = points[:, i]
+            variables[name + '0'] = lower[i]
+            variables[name + '1'] = upper[i]
+        return ne.evaluate(expression, local_dict=variables)
+
+    greater, less = (np.greater_equal, np.less_equal) if inclusive else (np.greater, np.less)
+    mask = greater(points[:, 0], lower[0])
+    buffer = np.empty_like(mask)
+    for i in range(3):
+        if i > 0:
+            mask &= greater(points[:, i], lower[i], out=buffer)
+        mask &= less(points[:, i], upper[i], out=buffer)
+    return mask
+
+
 def search_area_object(mesh, objct, factor=2):
     """Defines the search are in a mesh for a given object using a given factor that determines the
     search range."""
 
     cells = mesh.cell_centers
-    cell_width_X = min(mesh.h[0])  # minimum cell width in x-direction
-    cell_width_Y = min(mesh.h[1])  # minimum cell width in y-direction
-    cell_width_Z = min(mesh.h[2])  # minimum cell width in z-direction
-    Left_X = min(objct[:, 0])  # Left X
-    Right_X = max(objct[:, 0])  # Right X
-    Left_Y = min(objct[:, 1])  # Left Y
-    Right_Y = max(objct[:, 1])  # Right Y
-    Lower_Z = min(objct[:, 2])  # Lower Z
-    Upper_Z = max(objct[:, 2])  # Upper Z
-    search_area = cells[(cells[:, 0] > (Left_X - factor * cell_width_X)) & (
-            cells[:, 0] < (Right_X + factor * cell_width_X))
-                        & (cells[:, 1] > (Left_Y - factor * cell_width_Y)) & (
-                                cells[:, 1] < (Right_Y + factor * cell_width_Y))
-                        & (cells[:, 2] > (Lower_Z - factor * cell_width_Z)) & (
-                                cells[:, 2] < (Upper_Z + factor * cell_width_Z))]
+    cell_width = np.array([min(h) for h in mesh.h])  # minimum cell width in each direction
+    lower = objct.min(axis=0) - factor * cell_width  # Left X, Left Y and Lower Z
+    upper = objct.max(axis=0) + factor * cell_width  # Right X, Right Y and Upper Z
+    search_area = cells[box_mask(cells, lower, upper)]
 
     return search_area
 
@@ -61,21 +85,10 @@ def search_area_receivers(mesh, receiver_locations, factor=3):
     the search range."""
 
     cells = mesh.cell_centers
-    cell_width_X = min(mesh.h[0])  # minimum cell width in x-direction
-    cell_width_Y = min(mesh.h[1])  # minimum cell width in y-direction
-    cell_width_Z = min(mesh.h[2])  # minimum cell width in z-direction
-    Left_X = min(receiver_locations[:, 0])  # Left X
-    Right_X = max(receiver_locations[:, 0])  # Right X
-    Left_Y = min(receiver_locations[:, 1])  # Left Y
-    Right_Y = max(receiver_locations[:, 1])  # Right Y
-    Lower_Z = min(receiver_locations[:, 2])  # Lower Z
-    Upper_Z = max(receiver_locations[:, 2])  # Upper Z
-    search_area = cells[(cells[:, 0] > (Left_X - factor * cell_width_X)) & (
-            cells[:, 0] < (Right_X + factor * cell_width_X))
-                        & (cells[:, 1] > (Left_Y - factor * cell_width_Y)) & (
-                                cells[:, 1] < (Right_Y + factor * cell_width_Y))
-                        & (cells[:, 2] > (Lower_Z - factor * cell_width_Z)) & (
-                                cells[:, 2] < (Upper_Z + factor * cell_width_Z))]
+    cell_width = np.array([min(h) for h in mesh.h])  # minimum cell width in each direction
+    lower = receiver_locations.min(axis=0) - factor * cell_width  # Left X, Left Y and Lower Z
+    upper = receiver_locations.max(axis=0) + factor * cell_width  # Right X, Right Y and Upper Z
+    search_area = cells[box_mask(cells, lower, upper)]
 
     return search_area
 
@@ -85,21 +98,10 @@ def search_area_sources(mesh, source_locations, factor=3):
     the search range."""
 
     cells = mesh.cell_centers
-    cell_width_X = min(mesh.h[0])  # minimum cell width in x-direction
-    cell_width_Y = min(mesh.h[1])  # minimum cell width in y-direction
-    cell_width_Z = min(mesh.h[2])  # minimum cell width in z-direction
-    Left_X = min(source_locations[:, 0])  # Left X
-    Right_X = max(source_locations[:, 0])  # Right X
-    Left_Y = min(source_locations[:, 1])  # Left Y
-    Right_Y = max(source_locations[:, 1])  # Right Y
-    Lower_Z = min(source_locations[:, 2])  # Lower Z
-    Upper_Z = max(source_locations[:, 2])  # Upper Z
-    search_area = cells[(cells[:, 0] > (Left_X - factor * cell_width_X)) & (
-            cells[:, 0] < (Right_X + factor * cell_width_X))
-                        & (cells[:, 1] > (Left_Y - factor * cell_width_Y)) & (
-                                cells[:, 1] < (Right_Y + factor * cell_width_Y))
-                        & (cells[:, 2] > (Lower_Z - factor * cell_width_Z)) & (
-                                cells[:, 2] < (Upper_Z + factor * cell_width_Z))]
+    cell_width = np.array([min(h) for h in mesh.h])  # minimum cell width in each direction
+    lower = source_locations.min(axis=0) - factor * cell_width  # Left X, Left Y and Lower Z
+    upper = source_locations.max(axis=0) + factor * cell_width  # Right X, Right Y and Upper Z
+    search_area = cells[box_mask(cells, lower, upper)]
 
     return search_area
 
@@ -110,18 +112,10 @@ def search_area_landscape(mesh, domain, landscape, factor=3):
 
     cells = mesh.cell_centers
     cell_width_Z = min(mesh.h[2])  # minimum cell width in z-direction
-    Left_X = domain[0][0]  # Left X
-    Right_X = domain[0][1]  # Right X
-    Left_Y = domain[1][0]  # Left Y
-    Right_Y = domain[1][1]  # Right Y
-    Upper_Z = max(landscape[:, 2])  # Upper Z
-    Lower_Z = domain[2][0]  # Lower Z
-    search_area = cells[(cells[:, 0] > (Left_X)) & (
-            cells[:, 0] < (Right_X))
-                        & (cells[:, 1] > (Left_Y)) & (
-                                cells[:, 1] < (Right_Y))
-                        & (cells[:, 2] > (Lower_Z)) & (
-                                cells[:, 2] < (Upper_Z + factor * cell_width_Z))]
+    lower = (domain[0][0], domain[1][0], domain[2][0])  # Left X, Left Y and Lower Z
+    upper = (domain[0][1], domain[1][1],
+             max(landscape[:, 2]) + factor * cell_width_Z)  # Right X, Right Y and Upper Z
+    search_area = cells[box_mask(cells, lower, upper)]
 
     return search_area
 
@@ -129,30 +123,20 @@ def search_area_landscape(mesh, domain, landscape, factor=3):
 def get_ind_block(mesh, ind_active, coordinates, axis='x', degrees=0):
     """Retreives the indices of a block object coordinates in a mesh."""
 
-    grid = mesh.gridCC
+    # Only the active cell centers are selected and rotated, all at once
+    grid = mesh.gridCC[ind_active]
 
     if degrees != 0:
         rotation = Rot.from_euler(axis, -degrees, degrees=True).as_matrix()
-        grid = np.asarray([np.dot(rotation, i) for i in grid])
+        grid = grid @ rotation.T
 
-    return (
-            (grid[ind_active, 0] <= coordinates[0][1])
-            & (grid[ind_active, 0] >= coordinates[0][0])
-            & (grid[ind_active, 1] <= coordinates[1][1])
-            & (grid[ind_active, 1] >= coordinates[1][0])
-            & (grid[ind_active, 2] <= coordinates[2][1])
-            & (grid[ind_active, 2] >= coordinates[2][0])
-    )
+    lower = [bounds[0] for bounds in coordinates]
+    upper = [bounds[1] for bounds in coordinates]
+    return box_mask(grid, lower, upper, inclusive=True)
 
 
 def get_ind_sphere(mesh, ind_active, origin, radius):
     """Retreives the indices of a sphere object coordintes in a mesh."""
 
-    return (
-            (mesh.gridCC[ind_active, 0] <= origin[0] + radius)
-            & (mesh.gridCC[ind_active, 0] >= origin[0] - radius)
-            & (mesh.gridCC[ind_active, 1] <= origin[1] + radius)
-            & (mesh.gridCC[ind_active, 1] >= origin[1] - radius)
-            & (mesh.gridCC[ind_active, 2] <= origin[2] + radius)
-            & (mesh.gridCC[ind_active, 2] >= origin[2] - radius)
-    )
+    origin = np.asarray(origin)
+    return box_mask(mesh.gridCC[ind_active], origin - radius, origin + radius, inclusive=True)